@@ -17,79 +17,197 @@ import signal
 import sys
 import secrets
 import hashlib
+import hmac
+import base64
+import socket
+import threading
+import functools
+import atexit
+import string
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # Create the Modal app
 app = modal.App("discord-cloud-gaming")
 
+# Root of the moonlight-web-stream checkout
+REPO_ROOT = Path(__file__).parent.parent
+
 # Volume for persistent game data
 game_data = modal.Volume.from_name("discord-cloud-gaming-data", create_if_missing=True)
 
-# Build the container image with all dependencies
-image = (
+# Cloudflare TURN credentials shared across containers, keyed by TURN key ID
+turn_credentials = modal.Dict.from_name("discord-cloud-gaming-turn-cache", create_if_missing=True)
+
+# Volume for the web-server, streamer and frontend built by builder_image. Each build lives
+# in builds/<content hash>, and the CURRENT file names the one new containers should run.
+build_artifacts = modal.Volume.from_name("discord-cloud-gaming-build", create_if_missing=True)
+ARTIFACTS_DIR = "/artifacts"
+
+# Published builds kept on the volume, so containers still running an older one keep their files
+BUILDS_KEPT = 3
+
+# Runtime system packages, installed together with Sunshine in a single layer
+APT_PACKAGES = [
+    # X11 and display
+    "xvfb",
+    "x11-xserver-utils",
+    "x11-utils",
+    "xdotool",
+    # Audio
+    "pulseaudio",
+    "pulseaudio-utils",
+    # Video/GPU
+    "libva2",
+    "libva-drm2",
+    # Networking
+    "wget",
+    "curl",
+    "ca-certificates",
+    # TURN server
+    "coturn",
+    # Misc
+    "supervisor",
+    "dbus-x11",
+    "libxcb1",
+    "libxrandr2",
+    "libxfixes3",
+    "libxi6",
+    "libxcursor1",
+    "libxinerama1",
+    # Fallback font for the desktop and games streamed from the virtual display; with
+    # --no-install-recommends the image would otherwise have none for fontconfig to find
+    "fonts-dejavu-core",
+]
+
+# Toolchains needed only to build the Rust backend and the frontend
+BUILD_APT_PACKAGES = [
+    # Build tools for Rust
+    "build-essential",
+    "cmake",
+    "pkg-config",
+    "libssl-dev",
+    "libclang-dev",
+    "clang",
+    "lld",
+    "curl",
+    "ca-certificates",
+    # Node.js for frontend build
+    "nodejs",
+    "npm",
+]
+
+SUNSHINE_DEB_URL = "https://github.com/LizardByte/Sunshine/releases/latest/download/sunshine-ubuntu-24.04-amd64.deb"
+
+# Passed to cargo explicitly so RUSTFLAGS only reach the shipped binaries: build scripts and
+# proc-macros run on the image builder, whose CPU may lack AVX2, and keep baseline codegen
+RUST_TARGET = "x86_64-unknown-linux-gnu"
+
+
+def _publish_build_artifacts():
+    """
+    Copy the web-server, streamer and frontend built into builder_image onto the build_artifacts
+    volume as a new build, and make it the CURRENT one.
+
+    Builds are named by the hash of their files and never modified once published, so
+    republishing the same binaries is a no-op and running containers never see files change.
+    """
+    import shutil
+
+    files = [Path("/app/web-server"), Path("/app/streamer")]
+    files += sorted(path for path in Path("/app/static").rglob("*") if path.is_file())
+    digest = hashlib.blake2b(digest_size=8)
+    for path in files:
+        digest.update(str(path).encode())
+        digest.update(path.read_bytes())
+    build_id = digest.hexdigest()
+
+    builds_dir = f"{ARTIFACTS_DIR}/builds"
+    build_dir = f"{builds_dir}/{build_id}"
+    if not os.path.isdir(build_dir):
+        # Stage the copy and rename it into place, so a build directory is always complete
+        staging_dir = f"{build_dir}.tmp"
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        os.makedirs(staging_dir)
+        shutil.copy2("/app/web-server", f"{staging_dir}/web-server")
+        shutil.copy2("/app/streamer", f"{staging_dir}/streamer")
+        shutil.copytree("/app/static", f"{staging_dir}/static")
+        os.rename(staging_dir, build_dir)
+    # Mark the build as the newest one, even when it was published before
+    os.utime(build_dir)
+
+    with open(f"{ARTIFACTS_DIR}/CURRENT.tmp", "w") as f:
+        f.write(build_id)
+    os.replace(f"{ARTIFACTS_DIR}/CURRENT.tmp", f"{ARTIFACTS_DIR}/CURRENT")
+
+    builds = sorted(Path(builds_dir).iterdir(), key=lambda path: path.stat().st_mtime)
+    for old_build in builds[:-BUILDS_KEPT]:
+        shutil.rmtree(old_build)
+
+    build_artifacts.commit()
+    print(f"Published build {build_id} to {build_dir}")
+
+
+# Builder image: Rust and Node toolchains plus the compiled web-server, streamer and frontend.
+# It never runs the stream; its last build step publishes its outputs onto build_artifacts,
+# so every deploy that rebuilds the binaries also publishes them.
+# Same base as the runtime image so the binaries link against the same glibc.
+builder_image = (
     modal.Image.from_registry(
-        "nvidia/cuda:12.8.0-runtime-ubuntu24.04",
+        "nvidia/cuda:12.8.0-base-ubuntu24.04",
         add_python="3.12"
     )
-    # System dependencies
-    .apt_install(
-        # X11 and display
-        "xvfb",
-        "x11-xserver-utils",
-        "x11-utils",
-        "xdotool",
-        # Audio
-        "pulseaudio",
-        "pulseaudio-utils",
-        "alsa-utils",
-        # Video/GPU
-        "vainfo",
-        "mesa-va-drivers",
-        "libva2",
-        "libva-drm2",
-        # Build tools for Rust
-        "build-essential",
-        "cmake",
-        "pkg-config",
-        "libssl-dev",
-        "libclang-dev",
-        "clang",
-        # Networking
-        "wget",
-        "curl",
-        "ca-certificates",
-        "gnupg",
-        # TURN server
-        "coturn",
-        # Misc
-        "supervisor",
-        "dbus-x11",
-        "libxcb1",
-        "libxrandr2",
-        "libxfixes3",
-        "libxi6",
-        "libxcursor1",
-        "libxinerama1",
-        "fonts-dejavu-core",
-        # Node.js for frontend build
-        "nodejs",
-        "npm",
+    .run_commands(
+        "apt-get update && "
+        "DEBIAN_FRONTEND=noninteractive apt-get install -y --no-install-recommends " + " ".join(BUILD_APT_PACKAGES) + " && "
+        "rm -rf /var/lib/apt/lists/*"
     )
     # Install Rust nightly
     .run_commands(
         "curl --proto '=https' --tlsv1.2 -sSf https://sh.rustup.rs | sh -s -- -y --default-toolchain nightly",
         "echo 'source $HOME/.cargo/env' >> ~/.bashrc",
     )
-    .env({"PATH": "/root/.cargo/bin:$PATH"})
-    # Install Sunshine from GitHub releases
+    .env({
+        "PATH": "/root/.cargo/bin:$PATH",
+        # Incremental artifacts are never reused between image builds
+        "CARGO_INCREMENTAL": "0",
+        # Release tuning for the web-server and streamer: whole-program LTO in a single
+        # codegen unit, stripped binaries, and AVX2-era codegen for RUST_TARGET (every Modal
+        # GPU host is x86-64-v3), linked with lld to cut the link time of the big LTO'd binaries.
+        # panic stays "unwind" so a panicking tokio task doesn't abort the server.
+        "CARGO_PROFILE_RELEASE_LTO": "fat",
+        "CARGO_PROFILE_RELEASE_CODEGEN_UNITS": "1",
+        "CARGO_PROFILE_RELEASE_STRIP": "symbols",
+        "RUSTFLAGS": "-C target-cpu=x86-64-v3 -C link-arg=-fuse-ld=lld",
+        # Room for tsc on the whole frontend while cargo builds alongside it
+        "NODE_OPTIONS": "--max-old-space-size=4096",
+    })
+    # Fetch crate dependencies in a layer keyed only by the Cargo manifests, so source
+    # changes don't invalidate the download of every dependency
+    .add_local_file(REPO_ROOT / "Cargo.toml", "/app/moonlight-web-stream/Cargo.toml", copy=True)
+    .add_local_file(REPO_ROOT / "moonlight-client-simple/Cargo.toml", "/app/moonlight-web-stream/moonlight-client-simple/Cargo.toml", copy=True)
+    .add_local_file(REPO_ROOT / "moonlight-common/Cargo.toml", "/app/moonlight-web-stream/moonlight-common/Cargo.toml", copy=True)
+    .add_local_file(REPO_ROOT / "moonlight-common-sys/Cargo.toml", "/app/moonlight-web-stream/moonlight-common-sys/Cargo.toml", copy=True)
+    .add_local_file(REPO_ROOT / "moonlight-web/common/Cargo.toml", "/app/moonlight-web-stream/moonlight-web/common/Cargo.toml", copy=True)
+    .add_local_file(REPO_ROOT / "moonlight-web/streamer/Cargo.toml", "/app/moonlight-web-stream/moonlight-web/streamer/Cargo.toml", copy=True)
+    .add_local_file(REPO_ROOT / "moonlight-web/web-server/Cargo.toml", "/app/moonlight-web-stream/moonlight-web/web-server/Cargo.toml", copy=True)
     .run_commands(
-        "wget -q https://github.com/LizardByte/Sunshine/releases/latest/download/sunshine-ubuntu-24.04-amd64.deb -O /tmp/sunshine.deb",
-        "apt-get install -y /tmp/sunshine.deb || echo 'Sunshine install attempted'",
-        "rm /tmp/sunshine.deb",
+        # Cargo needs a target per crate to load the workspace; the stubs are removed again
+        # before the real sources are copied in
+        "cd /app/moonlight-web-stream && "
+        "CRATES='moonlight-client-simple moonlight-common moonlight-common-sys moonlight-web/common moonlight-web/streamer moonlight-web/web-server' && "
+        "for crate in $CRATES; do mkdir -p $crate/src && touch $crate/src/lib.rs; done && "
+        "/root/.cargo/bin/cargo fetch && "
+        "for crate in $CRATES; do rm -rf $crate/src; done",
     )
+    # Install frontend dependencies in a layer keyed only by the npm manifests; the
+    # source copy below ignores node_modules, so this layer is reused across source changes
+    .add_local_file(REPO_ROOT / "moonlight-web/web-server/package.json", "/app/moonlight-web-stream/moonlight-web/web-server/package.json", copy=True)
+    .add_local_file(REPO_ROOT / "moonlight-web/web-server/package-lock.json", "/app/moonlight-web-stream/moonlight-web/web-server/package-lock.json", copy=True)
+    .run_commands("cd /app/moonlight-web-stream/moonlight-web/web-server && npm ci --prefer-offline --no-audit --no-fund")
     # Copy the moonlight-web-stream source (copy=True needed for subsequent build steps)
     .add_local_dir(
-        str(Path(__file__).parent.parent),
+        str(REPO_ROOT),
         "/app/moonlight-web-stream",
         copy=True,
         ignore=[
@@ -99,30 +217,50 @@ image = (
             "discord-cloud-gaming/__pycache__",
         ]
     )
-    # Build the Rust backend
-    .run_commands(
-        "cd /app/moonlight-web-stream && /root/.cargo/bin/cargo build --release",
-        "cp /app/moonlight-web-stream/target/release/web-server /app/web-server || true",
-        "cp /app/moonlight-web-stream/target/release/streamer /app/streamer || true",
-    )
-    # Build the frontend
+    # Build the Rust backend and the frontend concurrently. The frontend's binding
+    # generation runs a debug-profile cargo test that shares no artifacts with the release
+    # build, so it gets its own target directory instead of waiting on the build lock. That
+    # test runs on the image builder, so it is built without the x86-64-v3 RUSTFLAGS.
     .run_commands(
-        "cd /app/moonlight-web-stream/moonlight-web/web-server && npm install && npm run build",
-        "ls -la /app/moonlight-web-stream/moonlight-web/web-server/dist/",
+        "set -e; "
+        f"(cd /app/moonlight-web-stream && CARGO_BUILD_JOBS=$(nproc) /root/.cargo/bin/cargo build --release --target {RUST_TARGET}) & RUST_PID=$!; "
+        "(cd /app/moonlight-web-stream/moonlight-web/web-server && RUSTFLAGS= CARGO_TARGET_DIR=/tmp/bindings-target npm run build) & NPM_PID=$!; "
+        "wait $RUST_PID && wait $NPM_PID",
+        f"cp /app/moonlight-web-stream/target/{RUST_TARGET}/release/web-server /app/web-server",
+        f"cp /app/moonlight-web-stream/target/{RUST_TARGET}/release/streamer /app/streamer",
         "mkdir -p /app/static && cp -r /app/moonlight-web-stream/moonlight-web/web-server/dist/* /app/static/",
         "ls -la /app/static/",
     )
-    # Copy configuration files from the already-copied source tree
+    .run_function(_publish_build_artifacts, volumes={ARTIFACTS_DIR: build_artifacts})
+)
+
+# Runtime image: only what the streaming container needs. The web-server, streamer and
+# frontend come from builder_image via the build_artifacts volume (see current_build_dir).
+image = (
+    # The -base variant is enough: NVENC/CUDA driver libraries are injected by the GPU host
+    modal.Image.from_registry(
+        "nvidia/cuda:12.8.0-base-ubuntu24.04",
+        add_python="3.12"
+    )
+    # System dependencies and Sunshine, sharing one apt index fetch in a single layer
     .run_commands(
-        "cp /app/moonlight-web-stream/discord-cloud-gaming/config/xorg.conf /etc/X11/xorg.conf || echo 'xorg.conf not found'",
-        "cp /app/moonlight-web-stream/discord-cloud-gaming/config/supervisord.conf /etc/supervisor/conf.d/gaming.conf || echo 'supervisord.conf not found'",
-        "mkdir -p /etc/sunshine && cp /app/moonlight-web-stream/discord-cloud-gaming/config/sunshine.conf /etc/sunshine/sunshine.conf || echo 'sunshine.conf not found'",
+        "apt-get update && "
+        "DEBIAN_FRONTEND=noninteractive apt-get install -y --no-install-recommends " + " ".join(APT_PACKAGES) + " && "
+        f"wget -q {SUNSHINE_DEB_URL} -O /tmp/sunshine.deb && "
+        "(DEBIAN_FRONTEND=noninteractive apt-get install -y --no-install-recommends /tmp/sunshine.deb || echo 'Sunshine install attempted') && "
+        "rm /tmp/sunshine.deb && "
+        "rm -rf /var/lib/apt/lists/*"
     )
-    # Create start-services.sh from base64 to avoid heredoc parsing issues
+    # Configuration files and the service startup script (scripts/start-services.sh),
+    # installed into place in a single layer
+    .add_local_dir(REPO_ROOT / "discord-cloud-gaming/config", "/app/config", copy=True)
+    .add_local_file(REPO_ROOT / "discord-cloud-gaming/scripts/start-services.sh", "/app/start-services.sh", copy=True)
     .run_commands(
-        "echo 'IyEvYmluL2Jhc2gKIyBTdGFydCBhbGwgc2VydmljZXMgZm9yIERpc2NvcmQgQ2xvdWQgR2FtaW5nCgpzZXQgLWUKCmVjaG8gIlN0YXJ0aW5nIERpc2NvcmQgQ2xvdWQgR2FtaW5nIHNlcnZpY2VzLi4uIgoKIyBDcmVhdGUgcmVxdWlyZWQgZGlyZWN0b3JpZXMKbWtkaXIgLXAgL3RtcC9ydW50aW1lCm1rZGlyIC1wIC90bXAvcHVsc2UKbWtkaXIgLXAgL2RhdGEvc3Vuc2hpbmUKbWtkaXIgLXAgL2RhdGEvc2VydmVyCmNobW9kIDcwMCAvdG1wL3J1bnRpbWUKCiMgRXhwb3J0IGVudmlyb25tZW50CmV4cG9ydCBESVNQTEFZPTo5OQpleHBvcnQgUFVMU0VfU0VSVkVSPXVuaXg6L3RtcC9wdWxzZS9uYXRpdmUKZXhwb3J0IFhER19SVU5USU1FX0RJUj0vdG1wL3J1bnRpbWUKZXhwb3J0IEhPTUU9L3Jvb3QKCiMgU3RhcnQgWHZmYiAodmlydHVhbCBkaXNwbGF5KQplY2hvICJTdGFydGluZyBYdmZiLi4uIgpYdmZiIDo5OSAtc2NyZWVuIDAgMTkyMHgxMDgweDI0IC1hYyArZXh0ZW5zaW9uIEdMWCArcmVuZGVyIC1ub3Jlc2V0ICYKWFZGQl9QSUQ9JCEKc2xlZXAgMgoKIyBWZXJpZnkgWCBpcyBydW5uaW5nCmlmICEgeGRweWluZm8gLWRpc3BsYXkgOjk5ID4vZGV2L251bGwgMj4mMTsgdGhlbgogICAgZWNobyAiRVJST1I6IFh2ZmIgZmFpbGVkIHRvIHN0YXJ0IgogICAgZXhpdCAxCmZpCmVjaG8gIlh2ZmIgc3RhcnRlZCBzdWNjZXNzZnVsbHkiCgojIFN0YXJ0IEQtQnVzCmVjaG8gIlN0YXJ0aW5nIEQtQnVzLi4uIgppZiBbICEgLVMgL3RtcC9kYnVzLXNlc3Npb24uc29jayBdOyB0aGVuCiAgICBkYnVzLWRhZW1vbiAtLXNlc3Npb24gLS1mb3JrIC0tcHJpbnQtYWRkcmVzcyA+IC90bXAvZGJ1cy1hZGRyZXNzCmZpCmV4cG9ydCBEQlVTX1NFU1NJT05fQlVTX0FERFJFU1M9JChjYXQgL3RtcC9kYnVzLWFkZHJlc3MgMj4vZGV2L251bGwgfHwgZWNobyAiIikKCiMgU3RhcnQgUHVsc2VBdWRpbwplY2hvICJTdGFydGluZyBQdWxzZUF1ZGlvLi4uIgpwdWxzZWF1ZGlvIC0tZGFlbW9uaXplPW5vIC0tZXhpdC1pZGxlLXRpbWU9LTEgLS1kaXNhYmxlLXNobSBcCiAgICAtLWxvYWQ9Im1vZHVsZS1uYXRpdmUtcHJvdG9jb2wtdW5peCBhdXRoLWFub255bW91cz0xIHNvY2tldD0vdG1wL3B1bHNlL25hdGl2ZSIgXAogICAgLS1sb2FkPSJtb2R1bGUtYWx3YXlzLXNpbmsiIFwKICAgIC0tbG9hZD0ibW9kdWxlLW51bGwtc2luayBzaW5rX25hbWU9Z2FtZV9hdWRpbyBzaW5rX3Byb3BlcnRpZXM9ZGV2aWNlLmRlc2NyaXB0aW9uPUdhbWVBdWRpbyIgJgpQVUxTRV9QSUQ9JCEKc2xlZXAgMgplY2hvICJQdWxzZUF1ZGlvIHN0YXJ0ZWQiCgojIENvbmZpZ3VyZSBkZWZhdWx0IGF1ZGlvIHNpbmsKcGFjdGwgc2V0LWRlZmF1bHQtc2luayBnYW1lX2F1ZGlvIDI+L2Rldi9udWxsIHx8IHRydWUKCiMgU3RhcnQgU3Vuc2hpbmUgaWYgaXQgZXhpc3RzCmlmIGNvbW1hbmQgLXYgc3Vuc2hpbmUgJj4gL2Rldi9udWxsOyB0aGVuCiAgICBlY2hvICJTdGFydGluZyBTdW5zaGluZS4uLiIKCiAgICAjIENyZWF0ZSBTdW5zaGluZSBjb25maWcgZGlyZWN0b3J5CiAgICBta2RpciAtcCAvZGF0YS9zdW5zaGluZQoKICAgICMgQ2hlY2sgaWYgU3Vuc2hpbmUgbmVlZHMgaW5pdGlhbCBzZXR1cAogICAgaWYgWyAhIC1mIC9kYXRhL3N1bnNoaW5lL3N1bnNoaW5lLmNvbmYgXTsgdGhlbgogICAgICAgIGVjaG8gIkNyZWF0aW5nIGluaXRpYWwgU3Vuc2hpbmUgY29uZmlndXJhdGlvbi4uLiIKICAgICAgICBjYXQgPiAvZGF0YS9zdW5zaGluZS9zdW5zaGluZS5jb25mIDw8ICdFT0YnCm9yaWdpbl93ZWJfdWlfYWxsb3dlZCA9IHdhbgplbmNvZGVyID0gbnZlbmMKbWluX2xvZ19sZXZlbCA9IGluZm8KRU9GCiAgICBmaQoKICAgICMgU3RhcnQgU3Vuc2hpbmUgd2l0aCBjb25maWcgZnJvbSBkYXRhIHZvbHVtZQogICAgc3Vuc2hpbmUgL2RhdGEvc3Vuc2hpbmUvc3Vuc2hpbmUuY29uZiAmCiAgICBTVU5TSElORV9QSUQ9JCEKICAgIHNsZWVwIDMKICAgIGVjaG8gIlN1bnNoaW5lIHN0YXJ0ZWQgKFBJRDogJFNVTlNISU5FX1BJRCkiCmVsc2UKICAgIGVjaG8gIldBUk5JTkc6IFN1bnNoaW5lIG5vdCBmb3VuZCwgc2tpcHBpbmcuLi4iCmZpCgojIFNpZ25hbCBoYW5kbGVyIGZvciBjbGVhbnVwCmNsZWFudXAoKSB7CiAgICBlY2hvICJTaHV0dGluZyBkb3duIHNlcnZpY2VzLi4uIgogICAga2lsbCAkU1VOU0hJTkVfUElEIDI+L2Rldi9udWxsIHx8IHRydWUKICAgIGtpbGwgJFBVTFNFX1BJRCAyPi9kZXYvbnVsbCB8fCB0cnVlCiAgICBraWxsICRYVkZCX1BJRCAyPi9kZXYvbnVsbCB8fCB0cnVlCiAgICBleGl0IDAKfQoKdHJhcCBjbGVhbnVwIFNJR1RFUk0gU0lHSU5UCgplY2hvICJBbGwgc2VydmljZXMgc3RhcnRlZCBzdWNjZXNzZnVsbHkiCmVjaG8gIkRpc3BsYXk6ICRESVNQTEFZIgplY2hvICJBdWRpbzogJFBVTFNFX1NFUlZFUiIKCiMgS2VlcCBzY3JpcHQgcnVubmluZwp3YWl0Cg==' | base64 -d > /app/start-services.sh",
-        "chmod +x /app/start-services.sh",
-        "ls -la /app/start-services.sh",
+        "install -D -m 0644 /app/config/xorg.conf /etc/X11/xorg.conf && "
+        "install -D -m 0644 /app/config/supervisord.conf /etc/supervisor/conf.d/gaming.conf && "
+        "install -D -m 0644 /app/config/sunshine.conf /etc/sunshine/sunshine.conf && "
+        "install -m 0644 /app/config/config.base.json /app/config.base.json && "
+        "chmod +x /app/start-services.sh"
     )
     # Set environment variables
     .env({
@@ -131,14 +269,87 @@ image = (
         "XDG_RUNTIME_DIR": "/tmp/runtime",
         "SUNSHINE_CONFIG_DIR": "/data/sunshine",
     })
-    # Install requests for Cloudflare API calls
-    .pip_install("requests")
+    # Install requests for Cloudflare API calls and orjson for fast config (de)serialization
+    .pip_install("requests", "orjson")
 )
 
 
+# Warm containers kept running so new sessions skip the Xvfb/PulseAudio/Sunshine boot.
+# Each one is a continuously billed L4; override with MIN_CONTAINERS=0 at deploy time.
+MIN_CONTAINERS = int(os.environ.get("MIN_CONTAINERS", "1"))
+
 # Secrets for Discord and TURN server credentials
 discord_secret = modal.Secret.from_name("discord-cloud-gaming", required_keys=[])
 
+# Public STUN servers at the head of every ICE server list; TURN entries are appended after
+STUN_SERVERS = (
+    {
+        "urls": (
+            "stun:stun.l.google.com:19302",
+            "stun:stun1.l.google.com:3478",
+            "stun:stun2.l.google.com:19302",
+        )
+    },
+)
+
+# Longest a single input to cloud_gaming_server may run. This does not bound the container:
+# the web-server outlives the call, and warm containers run indefinitely.
+INPUT_TIMEOUT = 3600 * 4
+
+# Minimum remaining validity of cached TURN credentials; refresh_turn_loop renews
+# credentials this many seconds before they expire
+TURN_VALIDITY_MARGIN = 600
+
+# Longest the startup path waits for Cloudflare TURN credentials before going STUN only,
+# keeping the boot well inside the web_server startup_timeout
+TURN_STARTUP_TIMEOUT = 15
+
+# Process-wide Cloudflare TURN credential cache, read by refresh_turn_loop to schedule renewals.
+# Its only writers are the startup fetch and refresh_turn_loop, which first waits a minute,
+# so the two never fetch at once.
+_turn_cache = {"ice_servers": None, "expires_at": 0.0}
+_turn_cache_lock = threading.Lock()
+# Set on exit to stop refresh_turn_loop between refreshes
+_turn_refresh_stop = threading.Event()
+atexit.register(_turn_refresh_stop.set)
+
+
+@functools.lru_cache(maxsize=1)
+def _cloudflare_session(api_token: str):
+    """
+    Shared HTTP session for Cloudflare API calls so retries and refreshes reuse the TLS connection.
+
+    Authenticated with api_token once, and closed when the container exits.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    session = requests.Session()
+    session.headers.update({
+        "Connection": "keep-alive",
+        "Accept-Encoding": "gzip",
+        "Authorization": f"Bearer {api_token}",
+    })
+    session.mount("https://", HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        # Retry rate limiting and transient Cloudflare errors instead of falling back to
+        # STUN only. urllib3 skips POST by default; generating credentials is safe to repeat.
+        # Retry-After is ignored so a rate-limiting edge can't stall startup with long waits.
+        # The last response is returned rather than raised so its error gets logged.
+        max_retries=Retry(
+            total=2,
+            backoff_factor=0.2,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=frozenset({"POST"}),
+            respect_retry_after_header=False,
+            raise_on_status=False,
+        ),
+    ))
+    atexit.register(session.close)
+    return session
+
 
 def fetch_cloudflare_turn_credentials(key_id: str, api_token: str, ttl: int = 86400) -> dict | None:
     """
@@ -152,32 +363,153 @@ def fetch_cloudflare_turn_credentials(key_id: str, api_token: str, ttl: int = 86
     Returns:
         ICE server configuration dict or None if failed
     """
-    import requests
+    import orjson
 
     try:
-        response = requests.post(
+        response = _cloudflare_session(api_token).post(
             f"https://rtc.live.cloudflare.com/v1/turn/keys/{key_id}/credentials/generate-ice-servers",
-            headers={
-                "Authorization": f"Bearer {api_token}",
-                "Content-Type": "application/json"
-            },
             json={"ttl": ttl},
-            timeout=10
+            # Bound the TCP/TLS connect separately from reading the response
+            timeout=(3.05, 10),
+            stream=True
         )
 
+        # Read the body exactly once and hand the connection straight back to the pool
+        with response:
+            body = response.content
+
         if response.status_code in (200, 201):  # 201 = Created is also success
-            data = response.json()
+            data = orjson.loads(body)
             # Cloudflare returns iceServers array
             if "iceServers" in data:
                 return data["iceServers"]
         else:
-            print(f"Cloudflare TURN API error: {response.status_code} - {response.text}")
+            print(f"Cloudflare TURN API error: {response.status_code} - {body.decode(errors='replace')}")
     except Exception as e:
         print(f"Failed to fetch Cloudflare TURN credentials: {e}")
 
     return None
 
 
+def get_cloudflare_ice_servers(key_id: str, api_token: str, ttl: int = 86400) -> list | None:
+    """
+    Return cached Cloudflare ICE servers, fetching new credentials only when the cache is cold or close to expiry.
+
+    Checks the in-process cache first, then the turn_credentials Dict shared by all containers,
+    so only one container per TTL window calls the Cloudflare API.
+
+    Containers have no bounded lifetime, so a cached entry is reused while it stays valid for
+    TURN_VALIDITY_MARGIN; refresh_turn_loop renews it and reloads the web-server before then.
+
+    Args:
+        key_id: Cloudflare TURN key ID
+        api_token: Cloudflare TURN API token
+        ttl: Time-to-live for credentials in seconds (default 24 hours)
+
+    Returns:
+        ICE server list or None if failed
+    """
+    def still_valid(expires_at):
+        return time.time() + TURN_VALIDITY_MARGIN < expires_at
+
+    with _turn_cache_lock:
+        if _turn_cache["ice_servers"] and still_valid(_turn_cache["expires_at"]):
+            return _turn_cache["ice_servers"]
+
+    try:
+        cached = turn_credentials.get(key_id)
+    except Exception as e:
+        print(f"Failed to read shared TURN credential cache: {e}")
+        cached = None
+
+    if cached and still_valid(cached["expires_at"]):
+        ice_servers, expires_at = cached["ice_servers"], cached["expires_at"]
+    else:
+        ice_servers = fetch_cloudflare_turn_credentials(key_id, api_token, ttl)
+        expires_at = time.time() + ttl
+        if ice_servers:
+            try:
+                turn_credentials.put(key_id, {"ice_servers": ice_servers, "expires_at": expires_at})
+            except Exception as e:
+                print(f"Failed to write shared TURN credential cache: {e}")
+
+    if ice_servers:
+        with _turn_cache_lock:
+            _turn_cache["ice_servers"] = ice_servers
+            _turn_cache["expires_at"] = expires_at
+
+    return ice_servers
+
+
+def split_ice_servers(ice_servers: list) -> list:
+    """
+    Expand ICE servers into one entry per URL, dropping duplicate URLs.
+
+    Separate entries make the browser probe every TURN endpoint on its own instead of
+    settling on the first URL of a shared entry.
+
+    Args:
+        ice_servers: ICE server entries, each with a "urls" list or string
+
+    Returns:
+        ICE server entries with a single URL each
+    """
+    seen = set()
+    split = []
+    for server in ice_servers:
+        urls = server["urls"]
+        for url in [urls] if isinstance(urls, str) else urls:
+            if url in seen:
+                continue
+            seen.add(url)
+            split.append({**server, "urls": [url]})
+    return split
+
+
+def refresh_turn_loop(key_id: str, api_token: str, ttl: int = 86400, on_refresh=None):
+    """
+    Keep the TURN credential cache warm, refreshing TURN_VALIDITY_MARGIN seconds before expiry.
+
+    Runs until _turn_refresh_stop is set.
+
+    Args:
+        key_id: Cloudflare TURN key ID
+        api_token: Cloudflare TURN API token
+        ttl: Time-to-live for credentials in seconds
+        on_refresh: Optional callback receiving the refreshed ICE server list
+    """
+    while True:
+        with _turn_cache_lock:
+            expires_at = _turn_cache["expires_at"]
+
+        # Retry failed fetches after a minute instead of spinning
+        if _turn_refresh_stop.wait(max(expires_at - TURN_VALIDITY_MARGIN - time.time(), 60)):
+            return
+
+        ice_servers = get_cloudflare_ice_servers(key_id, api_token, ttl)
+        if ice_servers and on_refresh:
+            on_refresh(ice_servers)
+
+
+@functools.lru_cache(maxsize=4)
+def _coturn_hmac(secret: str) -> hmac.HMAC:
+    """
+    HMAC-SHA1 keyed with the coturn shared secret. Callers copy() it, so minting a
+    credential skips re-encoding the secret and redoing the key schedule.
+    """
+    # Keep digestmod as hashlib.sha1: hmac maps it to OpenSSL's C HMAC, whereas a custom
+    # callable (e.g. one passing usedforsecurity=False) drops to the pure-Python HMAC
+    return hmac.new(secret.encode(), None, hashlib.sha1)
+
+
+@functools.lru_cache(maxsize=1)
+def _coturn_fallback_secret() -> str:
+    """
+    Random coturn secret used when TURN_SECRET is unset, stable for the life of the container.
+    """
+    return secrets.token_hex(32)
+
+
 def generate_coturn_credentials(secret: str, username: str = None, ttl: int = 86400) -> tuple[str, str]:
     """
     Generate time-limited TURN credentials using coturn's TURN REST API format.
@@ -190,86 +522,264 @@ def generate_coturn_credentials(secret: str, username: str = None, ttl: int = 86
     Returns:
         Tuple of (username, credential)
     """
-    import time
-    import hmac
-    import base64
-
     # Username format: timestamp:username
-    timestamp = int(time.time()) + ttl
+    timestamp = time.time_ns() // 1_000_000_000 + ttl
     user = f"{timestamp}:{username or 'user'}"
 
-    # Generate HMAC-SHA1 credential
-    credential = base64.b64encode(
-        hmac.new(secret.encode(), user.encode(), hashlib.sha1).digest()
-    ).decode()
+    # Generate HMAC-SHA1 credential from the pre-keyed prototype
+    mac = _coturn_hmac(secret).copy()
+    mac.update(user.encode())
+    credential = base64.b64encode(mac.digest()).decode("ascii")
 
     return user, credential
 
 
-def start_coturn_server(public_ip: str, secret: str, tcp_port: int = 3478) -> subprocess.Popen:
-    """
-    Start coturn TURN server with the given configuration.
-
-    Args:
-        public_ip: Public IP address to advertise
-        secret: Shared secret for credential generation
-        tcp_port: TCP port for TURN (UDP not available on Modal)
-
-    Returns:
-        Popen process handle
-    """
-    # Write coturn config
-    config = f"""
+# coturn config written by start_coturn_server; $relay_config is one of the two blocks below.
+# Relay endpoints are allocated on the container's own interfaces: the only relay peer is the
+# web-server in the same container, so neither relay-ip nor external-ip may point at the
+# tunnel's public address.
+COTURN_CONFIG_TEMPLATE = string.Template("""
 # Coturn configuration for Modal
-listening-port={tcp_port}
+listening-port=$tcp_port
+alt-listening-port=$alt_tcp_port
 tls-listening-port=5349
-relay-ip={public_ip}
-external-ip={public_ip}
 min-port=49152
 max-port=65535
 
 # Use long-term credentials with shared secret
 use-auth-secret
-static-auth-secret={secret}
+static-auth-secret=$secret
 realm=cloudgaming.modal.run
 
-# Enable TCP relay (since UDP ingress isn't available)
-no-udp
-no-dtls
-tcp-relay
-
+$relay_config
 # Logging
 log-file=/tmp/coturn.log
-verbose
+simple-log
+no-stdout-log
 
 # Performance
-total-quota=100
+no-cli
+stale-nonce=600
+total-quota=0
 max-bps=0
+""")
+
+COTURN_UDP_RELAY_CONFIG = """# Relay over UDP (and TCP), avoiding TCP head-of-line blocking on media
 """
 
+COTURN_TCP_RELAY_CONFIG = """# Enable TCP relay (since UDP ingress isn't available)
+no-udp
+no-dtls
+tcp-relay
+"""
+
+def start_coturn_server(secret: str, tcp_port: int = 3478, allow_udp: bool = False) -> subprocess.Popen:
+    """
+    Start coturn TURN server with the given configuration.
+
+    Args:
+        secret: Shared secret for credential generation
+        tcp_port: Port for TURN inside the container
+        allow_udp: Relay over UDP as well, only where UDP ingress reaches the container
+
+    Returns:
+        Popen process handle
+    """
+    config = COTURN_CONFIG_TEMPLATE.substitute(
+        tcp_port=tcp_port,
+        alt_tcp_port=tcp_port + 1,
+        secret=secret,
+        relay_config=COTURN_UDP_RELAY_CONFIG if allow_udp else COTURN_TCP_RELAY_CONFIG,
+    ).encode()
+
+    # The config holds the shared secret, so create it readable by root only
     config_path = "/tmp/turnserver.conf"
-    with open(config_path, "w") as f:
-        f.write(config)
+    fd = os.open(config_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        os.write(fd, config)
+    finally:
+        os.close(fd)
 
-    # Start turnserver
-    process = subprocess.Popen(
+    # Start turnserver. It logs to log-file, and nothing would ever drain a pipe, so a full
+    # pipe buffer would eventually block the relay.
+    # Own session, like start-services.sh, so signals aimed at this process group don't
+    # reach the relay
+    return subprocess.Popen(
         ["turnserver", "-c", config_path],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True
     )
 
-    return process
+
+# Larger socket buffers so bursts of WebRTC media don't get dropped as UDP overruns
+NET_SYSCTLS = {
+    "net.core.rmem_max": "134217728",
+    "net.core.wmem_max": "134217728",
+    "net.core.rmem_default": "16777216",
+    "net.core.netdev_max_backlog": "5000",
+}
+
+
+# PID of this container's start-services.sh, terminated on exit so its trap stops
+# Xvfb, PulseAudio and Sunshine instead of leaving them holding the X socket
+_services_pid = None
+
+
+def stop_services():
+    """
+    Terminate start-services.sh and reap it, if it was started.
+    """
+    if _services_pid is None:
+        return
+    try:
+        os.kill(_services_pid, signal.SIGTERM)
+        os.waitpid(_services_pid, 0)
+    except (ProcessLookupError, ChildProcessError):
+        pass
+
+
+def tune_network_buffers():
+    """
+    Apply NET_SYSCTLS, logging instead of failing when the container lacks CAP_NET_ADMIN.
+    """
+    for key, value in NET_SYSCTLS.items():
+        try:
+            with open(f"/proc/sys/{key.replace('.', '/')}", "w") as f:
+                f.write(value)
+        except OSError as e:
+            print(f"Could not set {key}={value}: {e}")
+
+
+def nvenc_available() -> bool:
+    """
+    Check whether NVENC is usable by loading the encode library the GPU host injects.
+
+    A dlopen is a few milliseconds, cheap enough to redo on every start instead of caching a
+    result that could go stale when the container lands on a different host.
+
+    Returns:
+        True if libnvidia-encode could be loaded
+    """
+    import ctypes
+
+    try:
+        ctypes.CDLL("libnvidia-encode.so.1")
+    except OSError as e:
+        print(f"WARNING: NVENC unavailable, falling back to software encoding: {e}")
+        return False
+    return True
+
+
+def wait_ready(paths: list[str], ports: list[int], timeout: float = 30) -> bool:
+    """
+    Wait until all given unix sockets/files exist and all local TCP ports accept connections.
+
+    Args:
+        paths: Filesystem paths that must exist
+        ports: TCP ports on 127.0.0.1 that must accept connections
+        timeout: Maximum time to wait in seconds
+
+    Returns:
+        True if everything became ready before the timeout
+    """
+    start = time.monotonic()
+    pending_paths = list(paths)
+    pending_ports = list(ports)
+
+    while time.monotonic() - start < timeout:
+        pending_paths = [path for path in pending_paths if not os.path.exists(path)]
+
+        still_pending_ports = []
+        for port in pending_ports:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            except OSError:
+                still_pending_ports.append(port)
+        pending_ports = still_pending_ports
+
+        if not pending_paths and not pending_ports:
+            print(f"Services ready after {(time.monotonic() - start) * 1000:.0f}ms")
+            return True
+
+        time.sleep(0.05)
+
+    print(f"WARNING: Services not ready after {timeout}s, waiting on: {pending_paths + pending_ports}")
+    return False
+
+
+@functools.lru_cache(maxsize=1)
+def current_build_dir() -> str:
+    """
+    Resolve the build_artifacts directory holding the CURRENT web-server, streamer and frontend.
+
+    Resolved once per container, so a build published later only reaches new containers.
+
+    Returns:
+        Path of the build directory
+
+    Raises:
+        RuntimeError: If no build has been published to the volume yet
+    """
+    try:
+        with open(f"{ARTIFACTS_DIR}/CURRENT") as f:
+            build_dir = f"{ARTIFACTS_DIR}/builds/{f.read().strip()}"
+    except FileNotFoundError:
+        build_dir = None
+
+    if build_dir is None or not os.path.isfile(f"{build_dir}/web-server"):
+        raise RuntimeError(
+            "No build published to the build_artifacts volume. "
+            "Run: modal run modal_app.py::publish_build_artifacts"
+        )
+    return build_dir
+
+
+@functools.lru_cache(maxsize=1)
+def load_static_config() -> dict:
+    """
+    Build the parts of the web-server config that are fixed for the life of the container:
+    the base config baked into the image plus the Discord and codec settings from the secret.
+
+    Returns:
+        Config dict without ICE servers; callers must not mutate it
+    """
+    import orjson
+
+    with open("/app/config.base.json", "rb") as f:
+        config = orjson.loads(f.read())
+
+    # The streamer binary is published next to the web-server
+    config["streamer_path"] = f"{current_build_dir()}/streamer"
+
+    # Add Discord config if credentials are provided
+    discord_client_id = os.environ.get("DISCORD_CLIENT_ID")
+    discord_client_secret = os.environ.get("DISCORD_CLIENT_SECRET")
+    if discord_client_id and discord_client_secret:
+        config.setdefault("discord", {}).update({
+            "client_id": discord_client_id,
+            "client_secret": discord_client_secret
+        })
+
+    # Opt-in AV1 default for new clients: the L4's NVENC encodes AV1 at a lower bitrate
+    # than H.264 for the same quality. Sunshine advertises AV1 whenever the GPU supports it.
+    if os.environ.get("ENABLE_AV1", "0") == "1":
+        config.setdefault("default_settings", {})["videoCodec"] = "av1"
+
+    return config
 
 
 @app.function(
     image=image,
     gpu="L4",
-    timeout=3600 * 4,  # 4 hour max session
-    volumes={"/data": game_data},
+    timeout=INPUT_TIMEOUT,
+    volumes={"/data": game_data, ARTIFACTS_DIR: build_artifacts},
     secrets=[discord_secret],
+    min_containers=MIN_CONTAINERS,
+    scaledown_window=1800,  # Keep idle containers for 30 minutes between sessions
 )
 @modal.concurrent(max_inputs=100)  # Allow concurrent WebRTC connections
-@modal.web_server(port=8080, startup_timeout=120)
+@modal.web_server(port=8080, startup_timeout=30)
 def cloud_gaming_server():
     """
     Main cloud gaming server endpoint.
@@ -284,8 +794,7 @@ def cloud_gaming_server():
     import subprocess
     import os
     import time
-    import json
-    import requests
+    import orjson
 
     # Create runtime directories
     os.makedirs("/tmp/runtime", exist_ok=True)
@@ -293,153 +802,200 @@ def cloud_gaming_server():
     os.makedirs("/data/sunshine", exist_ok=True)
     os.makedirs("/data/server", exist_ok=True)
 
-    # Start services via script
-    subprocess.Popen(["/app/start-services.sh"], shell=False)
+    # Fail before booting any service when there is no web-server to run
+    build_dir = current_build_dir()
 
-    # Give services time to start
-    time.sleep(5)
+    tune_network_buffers()
 
-    # Start the web server (this blocks and serves HTTP)
+    # Start services via script in their own session so they outlive this call. posix_spawn
+    # skips the fork of this (large, GPU-mapped) process that Popen with
+    # start_new_session would do; only stdio is inheritable, so no other fds leak.
+    global _services_pid
+    _services_pid = os.posix_spawn(
+        "/app/start-services.sh",
+        ["/app/start-services.sh"],
+        {**os.environ, "SUNSHINE_ENCODER": "nvenc" if nvenc_available() else "software"},
+        setsid=True,
+    )
+    atexit.register(stop_services)
+
+    cf_turn_key_id = os.environ.get("CLOUDFLARE_TURN_KEY_ID")
+    cf_turn_api_token = os.environ.get("CLOUDFLARE_TURN_API_TOKEN")
+
+    # Fetch Cloudflare TURN credentials while the services boot
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="turn-fetch")
+    cf_future = None
+    cf_deadline = time.monotonic() + TURN_STARTUP_TIMEOUT
+    if cf_turn_key_id and cf_turn_api_token:
+        print("Fetching Cloudflare TURN credentials...")
+        cf_future = executor.submit(get_cloudflare_ice_servers, cf_turn_key_id, cf_turn_api_token)
+    # Don't block on a slow fetch; it still fills the shared cache when it completes
+    executor.shutdown(wait=False)
+
+    # Wait for Xvfb, PulseAudio and Sunshine's HTTP port
+    wait_ready(["/tmp/.X11-unix/X99", "/tmp/pulse/native"], [47989], timeout=20)
+
+    # Environment for the web server
     env = os.environ.copy()
     env["RUST_LOG"] = "info"
 
     # Build ICE servers configuration
-    ice_servers = [
-        {
-            "urls": [
-                "stun:stun.l.google.com:19302",
-                "stun:stun1.l.google.com:3478",
-                "stun:stun2.l.google.com:19302"
-            ]
-        }
-    ]
+    ice_servers = list(STUN_SERVERS)
 
     # Try to configure TURN server
     turn_configured = False
 
-    # Option 1: Cloudflare TURN (recommended)
-    cf_turn_key_id = os.environ.get("CLOUDFLARE_TURN_KEY_ID")
-    cf_turn_api_token = os.environ.get("CLOUDFLARE_TURN_API_TOKEN")
-
-    if cf_turn_key_id and cf_turn_api_token:
-        print("Fetching Cloudflare TURN credentials...")
-        cf_ice_servers = fetch_cloudflare_turn_credentials(cf_turn_key_id, cf_turn_api_token)
+    # Option 1: Cloudflare TURN (recommended), fetched above
+    if cf_future:
+        try:
+            cf_ice_servers = cf_future.result(timeout=max(cf_deadline - time.monotonic(), 0))
+        except TimeoutError:
+            print(f"WARNING: Cloudflare TURN credentials not fetched within {TURN_STARTUP_TIMEOUT}s")
+            cf_ice_servers = None
         if cf_ice_servers:
-            ice_servers.extend(cf_ice_servers)
+            ice_servers.extend(split_ice_servers(cf_ice_servers))
             turn_configured = True
             print(f"Cloudflare TURN configured with {len(cf_ice_servers)} servers")
 
-    # Option 2: Manual TURN configuration (legacy)
+    # Option 2: Manual TURN configuration (legacy), one or more comma-separated URLs
     if not turn_configured:
-        turn_url = os.environ.get("TURN_SERVER_URL")
+        turn_urls = os.environ.get("TURN_SERVER_URLS") or os.environ.get("TURN_SERVER_URL")
         turn_username = os.environ.get("TURN_USERNAME")
         turn_credential = os.environ.get("TURN_CREDENTIAL")
-        if turn_url and turn_username and turn_credential:
+        if turn_urls and turn_username and turn_credential:
+            ice_servers.extend(split_ice_servers([{
+                "urls": [url.strip() for url in turn_urls.split(",") if url.strip()],
+                "username": turn_username,
+                "credential": turn_credential
+            }]))
+            turn_configured = True
+            print(f"Manual TURN configured: {turn_urls}")
+
+    # Option 3: Built-in coturn over TCP tunnel (fallback, opt-in)
+    # Note: This requires a TCP tunnel (e.g. modal.forward()) to port 3478 set up outside
+    # web_server, whose public host and port are passed in as TURN_PUBLIC_IP/TURN_PUBLIC_PORT
+    if not turn_configured and os.environ.get("ENABLE_COTURN", "0") == "1":
+        turn_public_ip = os.environ.get("TURN_PUBLIC_IP")
+        if turn_public_ip:
+            turn_public_port = int(os.environ.get("TURN_PUBLIC_PORT", "3478"))
+            turn_secret = os.environ.get("TURN_SECRET") or _coturn_fallback_secret()
+            turn_allow_udp = os.environ.get("TURN_ALLOW_UDP", "0") == "1"
+            start_coturn_server(turn_secret, allow_udp=turn_allow_udp)
+            turn_username, turn_credential = generate_coturn_credentials(turn_secret)
+            turn_urls = [f"turn:{turn_public_ip}:{turn_public_port}?transport=tcp"]
+            if turn_allow_udp:
+                turn_urls.insert(0, f"turn:{turn_public_ip}:{turn_public_port}?transport=udp")
             ice_servers.append({
-                "urls": [turn_url],
+                "urls": turn_urls,
                 "username": turn_username,
                 "credential": turn_credential
             })
             turn_configured = True
-            print(f"Manual TURN configured: {turn_url}")
+            print(f"Built-in coturn configured: {turn_public_ip}:{turn_public_port}")
+        else:
+            print("WARNING: ENABLE_COTURN is set but TURN_PUBLIC_IP is missing, skipping coturn")
 
-    # Option 3: Built-in coturn over TCP tunnel (fallback)
-    # Note: This requires modal.forward() which needs to be set up outside web_server
-    # For now, we'll skip this and recommend Cloudflare
     if not turn_configured:
         print("WARNING: No TURN server configured!")
         print("WebRTC may fail for users behind restrictive NATs.")
         print("Configure Cloudflare TURN by setting CLOUDFLARE_TURN_KEY_ID and CLOUDFLARE_TURN_API_TOKEN")
 
-    # Create config
+    # Copy the static config; write_config only replaces the webrtc section's ICE servers
     config_path = "/data/server/config.json"
-    config = {
-        "data_storage": {
-            "type": "json",
-            "path": "/data/server/data.json",
-            "session_expiration_check_interval": {"secs": 300, "nanos": 0}
-        },
-        "webrtc": {
-            "ice_servers": ice_servers,
-            "network_types": ["udp4", "udp6"],
-            "include_loopback_candidates": False
-        },
-        "web_server": {
-            "bind_address": "0.0.0.0:8080",
-            "session_cookie_secure": False,  # Modal proxy may use HTTP internally
-            "first_login_create_admin": True,
-            "first_login_assign_global_hosts": True
-        },
-        "streamer_path": "/app/streamer",
-        "log": {
-            "level_filter": "Info"
-        }
-    }
+    config = dict(load_static_config())
+    config["webrtc"] = dict(config["webrtc"])
 
-    # Add Discord config if credentials are provided
-    discord_client_id = os.environ.get("DISCORD_CLIENT_ID")
-    discord_client_secret = os.environ.get("DISCORD_CLIENT_SECRET")
-    if discord_client_id and discord_client_secret:
-        config["discord"] = {
-            "client_id": discord_client_id,
-            "client_secret": discord_client_secret
-        }
+    def write_config(ice_servers) -> bool:
+        """
+        Write config.json with the given ICE servers, returning whether the file changed.
+        """
+        config["webrtc"]["ice_servers"] = ice_servers
 
-    # Always write fresh config to pick up new TURN credentials
-    with open(config_path, "w") as f:
-        json.dump(config, f, indent=2)
+        # Skip the volume write when TURN credentials and Discord settings are unchanged,
+        # comparing a hash of the canonical (sorted, compact) JSON against the last write
+        signature = hashlib.blake2b(
+            orjson.dumps(config, option=orjson.OPT_SORT_KEYS), digest_size=16
+        ).hexdigest()
+        try:
+            with open(f"{config_path}.sig") as f:
+                if f.read() == signature and os.path.isfile(config_path):
+                    return False
+        except FileNotFoundError:
+            pass
+
+        # Write to a temporary file and rename it over the config, so a container killed
+        # mid-write never leaves a truncated config.json behind
+        with open(f"{config_path}.tmp", "wb") as f:
+            f.write(orjson.dumps(config, option=orjson.OPT_INDENT_2))
+        os.replace(f"{config_path}.tmp", config_path)
+        with open(f"{config_path}.sig", "w") as f:
+            f.write(signature)
+        return True
+
+    write_config(ice_servers)
 
     # Debug: verify setup before starting
     print("=== Pre-flight checks ===")
     print(f"Config written to: {config_path}")
-    print(f"Working directory: /app")
-
-    # Check static directory
-    import os.path
-    if os.path.isdir("/app/static"):
-        static_files = os.listdir("/app/static")
-        print(f"Static directory exists with {len(static_files)} items")
-        if "index.html" in static_files:
-            print("✓ index.html found")
-        else:
-            print("✗ index.html NOT found!")
-    else:
-        print("✗ Static directory /app/static does NOT exist!")
+    print(f"Working directory: {build_dir}")
 
-    # Check web-server binary
-    if os.path.isfile("/app/web-server"):
-        print("✓ web-server binary exists")
+    # Check the frontend, only listing the static directory when index.html is missing
+    if os.path.isfile(f"{build_dir}/static/index.html"):
+        print("✓ index.html found")
+    elif os.path.isdir(f"{build_dir}/static"):
+        with os.scandir(f"{build_dir}/static") as entries:
+            print(f"✗ index.html NOT found! Static directory has: {', '.join(entry.name for entry in entries)}")
     else:
-        print("✗ web-server binary NOT found!")
+        print(f"✗ Static directory {build_dir}/static does NOT exist!")
 
     # Check streamer binary
-    if os.path.isfile("/app/streamer"):
+    if os.path.isfile(f"{build_dir}/streamer"):
         print("✓ streamer binary exists")
     else:
         print("✗ streamer binary NOT found!")
 
     print("=== Starting web server ===")
-    print(f"Command: /app/web-server --config-path {config_path}")
+    print(f"Command: {build_dir}/web-server --config-path {config_path}")
 
     # Run web server with more verbose logging
     env["RUST_LOG"] = "debug,actix_web=info,actix_server=info"
 
-    subprocess.run(
-        ["/app/web-server", "--config-path", config_path],
+    # Modal proxies port 8080 once it accepts connections, no need to block on the process
+    web_server = subprocess.Popen(
+        [f"{build_dir}/web-server", "--config-path", config_path],
         env=env,
-        cwd="/app"
+        # The web server serves ./static relative to its working directory
+        cwd=build_dir
     )
 
+    def reload_ice_servers(cf_ice_servers):
+        # The web-server re-reads its ICE servers on SIGHUP; streams already running keep
+        # the credentials they were started with
+        if write_config([*STUN_SERVERS, *split_ice_servers(cf_ice_servers)]) and web_server.poll() is None:
+            web_server.send_signal(signal.SIGHUP)
+            print("Cloudflare TURN credentials refreshed")
+
+    # Refresh Cloudflare credentials in the background so new streams never get expired ones.
+    # This also delivers credentials whose startup fetch missed TURN_STARTUP_TIMEOUT.
+    if cf_turn_key_id and cf_turn_api_token:
+        threading.Thread(
+            target=refresh_turn_loop,
+            args=(cf_turn_key_id, cf_turn_api_token),
+            kwargs={"on_refresh": reload_ice_servers},
+            name="turn-refresh",
+            daemon=True,
+        ).start()
+
 
-@app.function(image=image, gpu="L4", timeout=300)
-def setup_sunshine_pairing():
+@app.function(image=builder_image, volumes={ARTIFACTS_DIR: build_artifacts}, timeout=600)
+def publish_build_artifacts():
     """
-    Helper function to set up Sunshine pairing.
-    Returns pairing PIN for manual entry.
+    Republish the build in builder_image, e.g. after the build_artifacts volume was emptied.
+
+    Deploys publish new builds on their own; this function also keeps builder_image part of
+    the app, so `modal deploy` builds it.
     """
-    # This would be called to initiate pairing
-    # In practice, we auto-pair Sunshine on the same container
-    pass
+    _publish_build_artifacts()
 
 
 @app.local_entrypoint()
@@ -459,7 +1015,11 @@ def main():
     print()
     print("  2. Manual TURN Server")
     print("     - Use your own coturn/TURN server")
-    print("     - Set: TURN_SERVER_URL, TURN_USERNAME, TURN_CREDENTIAL")
+    print("     - Set: TURN_SERVER_URL (or comma-separated TURN_SERVER_URLS), TURN_USERNAME, TURN_CREDENTIAL")
+    print()
+    print("  3. Built-in coturn (Experimental)")
+    print("     - Runs coturn inside the container, needs a TCP tunnel to port 3478")
+    print("     - Set: ENABLE_COTURN=1, TURN_PUBLIC_IP, TURN_PUBLIC_PORT, optionally TURN_SECRET")
     print()
     print("Setup secrets:")
     print("  modal secret create discord-cloud-gaming \\")
@@ -471,6 +1031,11 @@ def main():
     print("To deploy:")
     print("  modal deploy modal_app.py")
     print()
+    print("Warm containers:")
+    print(f"  {MIN_CONTAINERS} container(s) are kept warm so sessions join in about a second")
+    print("  instead of waiting for a cold start. Each warm container is a continuously")
+    print("  billed L4 GPU; deploy with MIN_CONTAINERS=0 to scale to zero when idle.")
+    print()
     print("To run locally for testing:")
     print("  modal serve modal_app.py")
     print()
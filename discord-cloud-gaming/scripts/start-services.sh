@@ -18,18 +18,38 @@ export PULSE_SERVER=unix:/tmp/pulse/native
 export XDG_RUNTIME_DIR=/tmp/runtime
 export HOME=/root
 
-# Start Xvfb (virtual display)
-echo "Starting Xvfb..."
-Xvfb :99 -screen 0 1920x1080x24 -ac +extension GLX +render -noreset &
-XVFB_PID=$!
-sleep 2
+# Poll a readiness command every 50ms for up to 10 seconds
+wait_until() {
+    for i in $(seq 1 200); do
+        "$@" >/dev/null 2>&1 && return 0
+        sleep 0.05
+    done
+    return 1
+}
 
-# Verify X is running
-if ! xdpyinfo -display :99 >/dev/null 2>&1; then
-    echo "ERROR: Xvfb failed to start"
-    exit 1
+# Pick the virtual display size. 4K is opt-in and only used on the L4/L40 family, which
+# has more than one NVENC engine; FFmpeg's nvenc encoder splits 4K frames across them
+# automatically. On anything else 4K60 wouldn't encode in real time.
+SCREEN_GEOMETRY=1920x1080x24
+if [ "${ENABLE_4K:-0}" = "1" ]; then
+    GPU_NAME=$(nvidia-smi --query-gpu=name --format=csv,noheader 2>/dev/null | head -n 1)
+    case "$GPU_NAME" in
+        *L4*)
+            SCREEN_GEOMETRY=3840x2160x24
+            ;;
+        *)
+            echo "WARNING: ENABLE_4K ignored, GPU '$GPU_NAME' is not a multi-NVENC L4/L40"
+            ;;
+    esac
 fi
-echo "Xvfb started successfully"
+
+# Xvfb and PulseAudio don't depend on each other, so start them in parallel and
+# only wait for both before starting Sunshine
+
+# Start Xvfb (virtual display)
+echo "Starting Xvfb ($SCREEN_GEOMETRY)..."
+Xvfb :99 -screen 0 $SCREEN_GEOMETRY -ac +extension GLX +render -noreset &
+XVFB_PID=$!
 
 # Start D-Bus
 echo "Starting D-Bus..."
@@ -45,12 +65,32 @@ pulseaudio --daemonize=no --exit-idle-time=-1 --disable-shm \
     --load="module-always-sink" \
     --load="module-null-sink sink_name=game_audio sink_properties=device.description=GameAudio" &
 PULSE_PID=$!
-sleep 2
+
+# Verify X is running
+if ! wait_until xdpyinfo -display :99; then
+    echo "ERROR: Xvfb failed to start"
+    exit 1
+fi
+echo "Xvfb started successfully"
+
+if ! wait_until pactl info; then
+    echo "ERROR: PulseAudio failed to start"
+    exit 1
+fi
 echo "PulseAudio started"
 
 # Configure default audio sink
 pactl set-default-sink game_audio 2>/dev/null || true
 
+# Set an option in the Sunshine config on the data volume, replacing any existing value
+set_sunshine_option() {
+    if grep -q "^$1 *=" /data/sunshine/sunshine.conf; then
+        sed -i "s|^$1 *=.*|$1 = $2|" /data/sunshine/sunshine.conf
+    else
+        echo "$1 = $2" >> /data/sunshine/sunshine.conf
+    fi
+}
+
 # Start Sunshine if it exists
 if command -v sunshine &> /dev/null; then
     echo "Starting Sunshine..."
@@ -64,15 +104,54 @@ if command -v sunshine &> /dev/null; then
         cat > /data/sunshine/sunshine.conf << 'EOF'
 origin_web_ui_allowed = wan
 encoder = nvenc
-min_log_level = info
+min_log_level = warning
 EOF
     fi
 
+    # Keep pairing state and Sunshine's certificate on the data volume. By default they
+    # live under $HOME/.config/sunshine, so every cold start would forget paired clients.
+    set_sunshine_option file_state /data/sunshine/sunshine_state.json
+    set_sunshine_option credentials_file /data/sunshine/sunshine_state.json
+    set_sunshine_option pkey /data/sunshine/credentials/cakey.pem
+    set_sunshine_option cert /data/sunshine/credentials/cacert.pem
+
+    # Encoder: cloud_gaming_server passes SUNSHINE_ENCODER=nvenc, or =software when it
+    # finds no usable NVENC. The encoder is set explicitly either way rather than left
+    # to Sunshine's own GPU detection.
+    set_sunshine_option encoder "${SUNSHINE_ENCODER:-nvenc}"
+
+    # Low-latency NVENC with the fastest P1 preset. Sunshine itself always configures
+    # NVENC with ultra-low-latency tuning, no B-frames and CBR rate control. It has no
+    # tuning option, so the B-frame-heavy UHQ tune can't be selected from here. On Linux
+    # it also passes delay=0, zerolatency=1 and forced-idr=1 to FFmpeg's nvenc encoder,
+    # so there is no frame queue to tune away. (nvenc_realtime_hags and
+    # nvenc_latency_over_power only apply to Sunshine's Windows encoder.)
+    set_sunshine_option nvenc_preset 1
+    set_sunshine_option nvenc_twopass disabled
+    set_sunshine_option nvenc_spatial_aq disabled
+    set_sunshine_option nvenc_h264_cavlc disabled
+    set_sunshine_option nvenc_vbv_increase 0
+
+    # Software fallback: x264 at its fastest zero-latency settings
+    set_sunshine_option sw_preset ultrafast
+    set_sunshine_option sw_tune zerolatency
+
+    # Always advertise HEVC Main (8-bit) so clients that can decode it pick it over H.264;
+    # it reaches the same quality with noticeably fewer bytes through the TURN relay.
+    # Clients without HEVC support still negotiate H.264.
+    set_sunshine_option hevc_mode 2
+    set_sunshine_option min_log_level warning
+
     # Start Sunshine with config from data volume
     sunshine /data/sunshine/sunshine.conf &
     SUNSHINE_PID=$!
-    sleep 3
-    echo "Sunshine started (PID: $SUNSHINE_PID)"
+
+    # Any HTTP response on the pairing port means Sunshine is up
+    if wait_until curl -s --max-time 1 -o /dev/null http://127.0.0.1:47989/; then
+        echo "Sunshine started (PID: $SUNSHINE_PID)"
+    else
+        echo "WARNING: Sunshine not answering on port 47989 yet (PID: $SUNSHINE_PID)"
+    fi
 else
     echo "WARNING: Sunshine not found, skipping..."
 fi
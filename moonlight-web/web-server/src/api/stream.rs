@@ -10,6 +10,7 @@ use common::{
         LogMessageType, PlayerSlot, PostCancelRequest, PostCancelResponse, RoomInfo, RoomRole,
         StreamClientMessage, StreamServerMessage,
     },
+    config::WebRtcConfig,
     ipc::{PeerId, ServerIpcMessage, StreamerConfig, StreamerIpcMessage, create_child_ipc},
     serialize_json,
 };
@@ -553,7 +554,10 @@ async fn handle_init_room(
     ipc_sender
         .send(ServerIpcMessage::Init {
             config: StreamerConfig {
-                webrtc: web_app.config().webrtc.clone(),
+                webrtc: WebRtcConfig {
+                    ice_servers: web_app.webrtc_ice_servers().await,
+                    ..web_app.config().webrtc.clone()
+                },
                 log_level: web_app.config().log.level_filter,
             },
             host_address: address,
@@ -6,7 +6,7 @@ use std::{
 };
 
 use actix_web::{ResponseError, http::StatusCode, web::Bytes};
-use common::config::Config;
+use common::{api_bindings::RtcIceServer, config::Config};
 use hex::FromHexError;
 use log::{error, warn};
 use moonlight_common::{
@@ -141,6 +141,8 @@ impl AppRef {
 
 struct AppInner {
     config: Config,
+    /// `config.webrtc.ice_servers`, replaced when the config is reloaded
+    webrtc_ice_servers: RwLock<Vec<RtcIceServer>>,
     storage: Arc<dyn Storage + Send + Sync>,
     app_image_cache: RwLock<HashMap<(UserId, HostId, AppId), Bytes>>,
     /// Room manager for multi-player streaming sessions
@@ -159,6 +161,7 @@ impl App {
     pub async fn new(config: Config) -> Result<Self, anyhow::Error> {
         let app = AppInner {
             storage: create_storage(config.data_storage.clone()).await?,
+            webrtc_ice_servers: RwLock::new(config.webrtc.ice_servers.clone()),
             config,
             app_image_cache: Default::default(),
             room_manager: RoomManager::new(),
@@ -188,6 +191,17 @@ impl App {
         &self.inner.config
     }
 
+    /// The ice servers handed to new streamers.
+    /// Unlike `config().webrtc.ice_servers` this reflects config reloads.
+    pub async fn webrtc_ice_servers(&self) -> Vec<RtcIceServer> {
+        self.inner.webrtc_ice_servers.read().await.clone()
+    }
+
+    /// Replaces the ice servers for streamers started from now on, running streams keep theirs.
+    pub async fn set_webrtc_ice_servers(&self, ice_servers: Vec<RtcIceServer>) {
+        *self.inner.webrtc_ice_servers.write().await = ice_servers;
+    }
+
     /// Handles all logic related to adding the first user:
     /// - Is this even currently allowed?
     /// - Moving hosts from global to first user
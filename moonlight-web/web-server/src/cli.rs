@@ -67,7 +67,7 @@ pub enum Command {
     PrintConfig,
 }
 
-#[derive(Args)]
+#[derive(Args, Clone)]
 pub struct CliConfig {
     /// Overwrites `webrtc.port_range`. Specify like this: "MIN:MAX".
     #[arg(long, env = "WEBRTC_PORT_RANGE")]
@@ -14,7 +14,7 @@ use simplelog::{ColorChoice, CombinedLogger, SharedLogger, TermLogger, TerminalM
 use crate::{
     api::api_service,
     app::App,
-    cli::{Cli, Command},
+    cli::{Cli, CliConfig, Command},
     human_json::preprocess_human_json,
     web::{web_config_js_service, web_service},
 };
@@ -30,6 +30,8 @@ mod human_json;
 #[actix_web::main]
 async fn main() {
     let cli = Cli::load();
+    // Re-applied on top of the file whenever the config is reloaded
+    let reload_options = cli.options.clone();
 
     // Load Config
     let config_path = PathBuf::from_str(&cli.config_path).expect("invalid config file path");
@@ -53,7 +55,7 @@ async fn main() {
                     .await
                     .expect("failed to create directories to file");
             }
-            fs::write(config_path, value_str)
+            fs::write(&config_path, value_str)
                 .await
                 .expect("failed to write default file");
 
@@ -103,15 +105,28 @@ async fn main() {
 
     CombinedLogger::init(loggers).expect("failed to init combined logger");
 
-    if let Err(err) = start(config).await {
+    if let Err(err) = start(config, config_path, reload_options).await {
         error!("{err:?}");
     }
 }
 
-async fn start(config: Config) -> Result<(), anyhow::Error> {
+async fn start(
+    config: Config,
+    config_path: PathBuf,
+    reload_options: CliConfig,
+) -> Result<(), anyhow::Error> {
     let app = App::new(config.clone()).await?;
     let app = Data::new(app);
 
+    #[cfg(unix)]
+    tokio::spawn(reload_ice_servers_on_sighup(
+        app.clone(),
+        config_path,
+        reload_options,
+    ));
+    #[cfg(not(unix))]
+    let _ = (config_path, reload_options);
+
     let bind_address = app.config().web_server.bind_address;
     let server = HttpServer::new({
         let url_path_prefix = config.web_server.url_path_prefix.clone();
@@ -162,3 +177,42 @@ async fn start(config: Config) -> Result<(), anyhow::Error> {
 
     Ok(())
 }
+
+/// Reloads `webrtc.ice_servers` from the config file on every SIGHUP, so rotated TURN
+/// credentials reach new streams without restarting the server and dropping running ones.
+#[cfg(unix)]
+async fn reload_ice_servers_on_sighup(app: Data<App>, config_path: PathBuf, options: CliConfig) {
+    use tokio::signal::unix::{SignalKind, signal};
+
+    let mut hangup = match signal(SignalKind::hangup()) {
+        Ok(hangup) => hangup,
+        Err(err) => {
+            error!("[Config]: failed to listen for SIGHUP, config reloads are disabled: {err}");
+            return;
+        }
+    };
+
+    while hangup.recv().await.is_some() {
+        let value = match fs::read_to_string(&config_path).await {
+            Ok(value) => preprocess_human_json(value),
+            Err(err) => {
+                error!("[Config]: failed to reload config file: {err}");
+                continue;
+            }
+        };
+        let mut config: Config = match serde_json::from_str(&value) {
+            Ok(config) => config,
+            Err(err) => {
+                error!("[Config]: failed to parse reloaded config file: {err}");
+                continue;
+            }
+        };
+        options.clone().apply(&mut config);
+
+        info!(
+            "[Config]: reloaded {} ice servers",
+            config.webrtc.ice_servers.len()
+        );
+        app.set_webrtc_ice_servers(config.webrtc.ice_servers).await;
+    }
+}